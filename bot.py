@@ -1,11 +1,14 @@
+import asyncio
 import logging
+import os
 import re
-from datetime import datetime, time
+import time as timer
+from datetime import datetime, time, timedelta, timezone
 from typing import Optional, List, Dict, Any
 
-from telegram import Update, constants
+from telegram import Update, constants, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, ContextTypes,
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes,
     filters, CallbackContext
 )
 from telegram.error import BadRequest
@@ -24,6 +27,9 @@ logger = logging.getLogger(__name__)
 class ClassBot:
     def __init__(self):
         self.application = None
+        self.backup_lock = asyncio.Lock()
+        self.maintenance_lock = asyncio.Lock()
+        self.last_activity = timer.monotonic()
 
     async def is_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
         """Проверяет, является ли пользователь администратором"""
@@ -68,8 +74,19 @@ class ClassBot:
             "/post_t_schedule [текст] - установить график звонков\n"
             "/post_ready_hw [текст] - установить готовое ДЗ\n"
             "/set_duty @user1 @user2 - установить дежурных\n"
+            "/set_roster @user1 @user2 ... - установить график дежурств\n"
+            "/add_holiday ГГГГ-ММ-ДД [ГГГГ-ММ-ДД] - дни без дежурства\n"
             "/post_schedule [текст] - установить расписание\n"
             "/get_chat_log - получить лог чата\n"
+            "/backup - создать резервную копию базы\n"
+            "/compress_archive - сжать архив сообщений\n"
+            "/db_profile [on|off|reset] - профиль запросов к базе\n"
+            "/set_retention [дни] - срок хранения архива чата\n"
+            "/maintenance - очистить устаревшие записи и сжать базу\n"
+            "/browse_log - листать последние сообщения чата\n"
+            "/get_media_log - получить список медиа чата\n"
+            "/chat_stats - статистика активности чата\n"
+            "/rebuild_stats - пересчитать статистику по архиву\n"
             "https://nash10Aklacc.ru/ - наш сайт, список изменений бота (в 2.0 версии)\n"
             "/generate [промпт] (в 2.1 версии)\n"
             "/get_user_log @user - получить лог пользователя\n\n"
@@ -184,6 +201,46 @@ class ClassBot:
         else:
             await update.message.reply_text("👥 Дежурные не назначены.")
 
+    async def set_roster(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Установка графика дежурств"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        if len(context.args) < 2:
+            await update.message.reply_text("❌ Укажите участников графика через @username (минимум двух)!")
+            return
+
+        members = [arg.lstrip('@') for arg in context.args]
+        db.save_duty_roster(update.effective_chat.id, members)
+        await update.message.reply_text(
+            "✅ График дежурств установлен: " + ", ".join(f"@{m}" for m in members)
+        )
+
+    async def add_holiday(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Добавление праздников и каникул в график дежурств"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        if not context.args:
+            await update.message.reply_text("❌ Формат: /add_holiday ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]")
+            return
+
+        try:
+            start = datetime.strptime(context.args[0], "%Y-%m-%d").date()
+            end = datetime.strptime(context.args[1], "%Y-%m-%d").date() if len(context.args) > 1 else start
+        except ValueError:
+            await update.message.reply_text("❌ Неверный формат даты. Используйте ГГГГ-ММ-ДД")
+            return
+
+        if end < start:
+            await update.message.reply_text("❌ Дата окончания раньше даты начала!")
+            return
+
+        count = db.add_duty_holidays(update.effective_chat.id, start, end)
+        await update.message.reply_text(f"✅ Добавлено дней без дежурства: {count}")
+
     # Schedule functions
     async def post_schedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Установка расписания"""
@@ -255,8 +312,34 @@ class ClassBot:
     #        await context.bot.send_message(chat_id, f"⏰ Напоминание: {message}")
 
     # Archive functions
+    @staticmethod
+    def extract_media(message) -> Optional[Dict[str, Any]]:
+        """Извлекает метаданные медиа из сообщения (файл не скачивается)"""
+        if message.photo:
+            # Берем самый большой размер фотографии
+            media_type, item = 'photo', message.photo[-1]
+        else:
+            for media_type in ('animation', 'video', 'video_note', 'voice', 'audio', 'document', 'sticker'):
+                item = getattr(message, media_type, None)
+                if item:
+                    break
+            else:
+                return None
+
+        return {
+            'file_unique_id': item.file_unique_id,
+            'file_id': item.file_id,
+            'media_type': media_type,
+            'file_size': getattr(item, 'file_size', None),
+            'width': getattr(item, 'width', None),
+            'height': getattr(item, 'height', None),
+            'duration': getattr(item, 'duration', None),
+            'mime_type': getattr(item, 'mime_type', None)
+        }
+
     async def archive_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Архивация сообщения"""
+        self.last_activity = timer.monotonic()
         try:
             message = update.effective_message
             user = update.effective_user
@@ -275,7 +358,8 @@ class ClassBot:
                 'phone_number': None,
                 'photo_id': None,
                 'text': message.text or message.caption or '',
-                'date': message.date
+                'date': message.date,
+                'media': self.extract_media(message)
             }
 
             db.save_message(message_data)
@@ -297,9 +381,10 @@ class ClassBot:
             return
 
         log_text = f"Лог чата {chat_id}\n{'=' * 50}\n\n"
-        for msg_date, username, first_name, last_name, text in messages:
+        for msg_date, username, first_name, last_name, text, media_type, media_id in messages:
             name = f"@{username}" if username else f"{first_name} {last_name}".strip()
-            log_text += f"[{msg_date}] {name}: {text}\n"
+            media = f" [{media_type}: {media_id}]" if media_id else ""
+            log_text += f"[{msg_date}] {name}: {text}{media}\n"
 
         try:
             await context.bot.send_document(
@@ -311,6 +396,100 @@ class ClassBot:
         except BadRequest:
             await update.message.reply_text("❌ Напишите мне в личные сообщения сначала!")
 
+    # Log browsing functions
+    @staticmethod
+    def to_base36(value: int) -> str:
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+        encoded = ""
+        while True:
+            value, rest = divmod(value, 36)
+            encoded = digits[rest] + encoded
+            if not value:
+                break
+        return encoded
+
+    def encode_log_cursor(self, older: bool, msg_date: str, row_id: int) -> str:
+        """Кодирует курсор страницы в callback_data: log:<o|n>:<дата>:<id>.
+
+        Дата - микросекунды от эпохи в base36, чтобы курсор не зависел от того,
+        осталось ли крайнее сообщение в архиве.
+        """
+        moment = datetime.fromisoformat(str(msg_date))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        micros = (moment - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1)
+        return f"log:{'o' if older else 'n'}:{self.to_base36(micros)}:{self.to_base36(row_id)}"
+
+    @staticmethod
+    def decode_log_cursor(data: str) -> tuple:
+        """Разбирает callback_data курсора, возвращает (older, (дата, id))"""
+        _, direction, encoded_date, encoded_id = data.split(':')
+        moment = datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=int(encoded_date, 36))
+        # str(datetime) совпадает с тем, как sqlite3 сохраняет message.date
+        return direction == 'o', (str(moment), int(encoded_id, 36))
+
+    def render_log_page(self, rows: List[tuple], has_older: bool, has_newer: bool) -> tuple:
+        """Текст страницы лога и клавиатура навигации"""
+        lines = []
+        for row_id, msg_date, username, first_name, last_name, text, media_type in rows:
+            name = f"@{username}" if username else f"{first_name or ''} {last_name or ''}".strip()
+            text = text or ''
+            if len(text) > 300:
+                text = text[:300] + "…"
+            media = f" [{media_type}]" if media_type else ""
+            lines.append(f"[{str(msg_date)[:16]}] {name}: {text}{media}")
+
+        buttons = []
+        if has_older:
+            buttons.append(InlineKeyboardButton("⬅️ Старше", callback_data=self.encode_log_cursor(True, rows[0][1], rows[0][0])))
+        if has_newer:
+            buttons.append(InlineKeyboardButton("Новее ➡️", callback_data=self.encode_log_cursor(False, rows[-1][1], rows[-1][0])))
+
+        markup = InlineKeyboardMarkup([buttons]) if buttons else None
+        return "📜 Лог чата:\n\n" + "\n".join(lines), markup
+
+    async def browse_log(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Постраничный просмотр последних сообщений чата"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        rows, has_older = db.get_chat_log_page(update.effective_chat.id, limit=config.LOG_PAGE_SIZE)
+        if not rows:
+            await update.message.reply_text("📝 Нет сообщений в архиве для этого чата.")
+            return
+
+        text, markup = self.render_log_page(rows, has_older=has_older, has_newer=False)
+        await update.message.reply_text(text, reply_markup=markup)
+
+    async def browse_log_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик кнопок «Старше»/«Новее» в /browse_log"""
+        query = update.callback_query
+        if not await self.is_admin(update, context):
+            await query.answer("❌ Эта команда только для администраторов!", show_alert=True)
+            return
+
+        try:
+            older, page_cursor = self.decode_log_cursor(query.data)
+        except ValueError:
+            await query.answer("❌ Неверные данные кнопки")
+            return
+
+        rows, has_more = db.get_chat_log_page(
+            update.effective_chat.id, page_cursor=page_cursor, older=older, limit=config.LOG_PAGE_SIZE
+        )
+        if not rows:
+            await query.answer("📝 Больше сообщений нет.")
+            return
+
+        # Страница в противоположном направлении заведомо существует (курсор)
+        if older:
+            text, markup = self.render_log_page(rows, has_older=has_more, has_newer=True)
+        else:
+            text, markup = self.render_log_page(rows, has_older=True, has_newer=has_more)
+        await query.answer()
+        await query.edit_message_text(text, reply_markup=markup)
+
     async def get_user_log(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Получение лога пользователя"""
         if not await self.is_admin(update, context):
@@ -331,8 +510,9 @@ class ClassBot:
             return
 
         log_text = f"Лог пользователя @{username}\n{'=' * 50}\n\n"
-        for msg_date, chat_title, text in messages:
-            log_text += f"[{msg_date}] {chat_title}: {text}\n"
+        for msg_date, chat_title, text, media_type, media_id in messages:
+            media = f" [{media_type}: {media_id}]" if media_id else ""
+            log_text += f"[{msg_date}] {chat_title}: {text}{media}\n"
 
         try:
             await context.bot.send_document(
@@ -344,6 +524,323 @@ class ClassBot:
         except BadRequest:
             await update.message.reply_text("❌ Напишите мне в личные сообщения сначала!")
 
+    async def get_media_log(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Получение списка медиа чата"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        chat_id = update.effective_chat.id
+        media = db.get_chat_media(chat_id)
+
+        if not media:
+            await update.message.reply_text("📝 Нет медиа в архиве для этого чата.")
+            return
+
+        log_text = f"Медиа чата {chat_id}\n{'=' * 50}\n\n"
+        for msg_date, message_id, media_type, file_unique_id, file_id, file_size, width, height, duration in media:
+            details = ", ".join(
+                f"{key}={value}" for key, value in
+                (('size', file_size), ('w', width), ('h', height), ('duration', duration))
+                if value is not None
+            )
+            log_text += f"[{msg_date}] #{message_id} {media_type} {file_unique_id} ({details}) file_id={file_id}\n"
+
+        try:
+            await context.bot.send_document(
+                chat_id=update.effective_user.id,
+                document=log_text.encode('utf-8'),
+                filename=f"media_log_{chat_id}.txt"
+            )
+            await update.message.reply_text("📁 Список медиа отправлен в ваши личные сообщения.")
+        except BadRequest:
+            await update.message.reply_text("❌ Напишите мне в личные сообщения сначала!")
+
+    # Stats functions
+    async def chat_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Статистика активности чата"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        chat_id = update.effective_chat.id
+        daily = db.get_chat_daily_stats(chat_id, days=7)
+
+        if not daily:
+            await update.message.reply_text("📊 За последнюю неделю сообщений нет.")
+            return
+
+        stats_text = "📊 Статистика чата за 7 дней:\n\n"
+        for day, count in daily:
+            stats_text += f"{day}: {count}\n"
+        stats_text += f"\nВсего: {sum(count for _, count in daily)}\n"
+
+        top_users = db.get_chat_top_users(chat_id, days=7, limit=5)
+        if top_users:
+            stats_text += "\n🏆 Самые активные:\n"
+            for user_id, username, first_name, last_name, total in top_users:
+                name = f"@{username}" if username else f"{first_name or ''} {last_name or ''}".strip() or str(user_id)
+                stats_text += f"{name}: {total}\n"
+
+        await update.message.reply_text(stats_text)
+
+    async def rebuild_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пересчет статистики чата по архиву"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        total = await asyncio.to_thread(db.rebuild_activity_stats, update.effective_chat.id)
+        await update.message.reply_text(f"✅ Статистика пересчитана, учтено сообщений: {total}")
+
+    async def compress_archive(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обучение словаря и сжатие архива сообщений"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        if not config.ARCHIVE_COMPRESSION:
+            await update.message.reply_text("❌ Сжатие архива выключено (ARCHIVE_COMPRESSION в config.py).")
+            return
+
+        await update.message.reply_text("🗜 Сжатие архива запущено...")
+        try:
+            dict_id = await asyncio.to_thread(db.train_text_dictionary)
+            stats = await asyncio.to_thread(db.compress_archive)
+        except Exception as e:
+            logger.error(f"Ошибка сжатия архива: {e}")
+            await update.message.reply_text(f"❌ Ошибка сжатия архива: {e}")
+            return
+
+        await update.message.reply_text(
+            "✅ Архив сжат\n\n"
+            f"Сообщений: {stats['rows']}\n"
+            f"Словарь: #{dict_id}, {stats['dict_size'] / 1024:.1f} КБ\n"
+            f"Текст: {stats['raw_bytes'] / 1024:.1f} КБ -> {stats['stored_bytes'] / 1024:.1f} КБ "
+            f"(x{stats['ratio']:.2f})\n"
+            f"Чтение: {stats['plain_read_us']:.1f} мкс без распаковки, "
+            f"{stats['unpack_read_us']:.1f} мкс с распаковкой "
+            f"(+{stats['decode_us']:.1f} мкс на сообщение)"
+        )
+
+    async def db_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отчет профилировщика запросов (/db_profile [on|off|reset])"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        action = context.args[0].lower() if context.args else None
+        if action == 'on':
+            db.enable_profiling(config.DB_SLOW_QUERY_MS)
+            await update.message.reply_text("✅ Профилирование запросов включено.")
+            return
+        if action == 'off':
+            db.disable_profiling()
+            await update.message.reply_text("✅ Профилирование запросов выключено.")
+            return
+        if db.profiler is None:
+            await update.message.reply_text("❌ Профилирование выключено. Включите: /db_profile on")
+            return
+        if action == 'reset':
+            db.profiler.reset()
+            await update.message.reply_text("✅ Статистика запросов сброшена.")
+            return
+
+        try:
+            await context.bot.send_document(
+                chat_id=update.effective_user.id,
+                document=db.profiler.report().encode('utf-8'),
+                filename="db_profile.txt"
+            )
+            await update.message.reply_text("📁 Отчет по запросам отправлен в ваши личные сообщения.")
+        except BadRequest:
+            await update.message.reply_text("❌ Напишите мне в личные сообщения сначала!")
+
+    # Backup functions
+    async def run_backup(self) -> Dict[str, Any]:
+        """Резервная копия в отдельном потоке с замером задержек цикла событий"""
+        async with self.backup_lock:
+            lags = []
+            done = asyncio.Event()
+
+            async def probe(interval: float = 0.05):
+                # Насколько позже срока просыпается цикл событий (задержка обработчиков)
+                while not done.is_set():
+                    started = timer.perf_counter()
+                    await asyncio.sleep(interval)
+                    lags.append(timer.perf_counter() - started - interval)
+
+            probe_task = asyncio.create_task(probe())
+            try:
+                stats = await asyncio.to_thread(
+                    db.backup, config.BACKUP_DIR, config.BACKUP_KEEP,
+                    config.BACKUP_PAGES_PER_STEP, config.BACKUP_STEP_PAUSE, config.BACKUP_MAX_RESTARTS
+                )
+            finally:
+                done.set()
+                await probe_task
+
+            stats['max_lag'] = max(lags, default=0.0)
+            stats['avg_lag'] = sum(lags) / len(lags) if lags else 0.0
+            return stats
+
+    async def scheduled_backup(self, context: CallbackContext):
+        """Резервная копия по расписанию"""
+        try:
+            stats = await self.run_backup()
+            logger.info(
+                f"Резервная копия по расписанию: {stats['duration']:.2f} с, "
+                f"макс. задержка обработчиков {stats['max_lag'] * 1000:.1f} мс"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка резервного копирования: {e}")
+
+    async def backup(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ручной запуск резервного копирования"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        if self.backup_lock.locked():
+            await update.message.reply_text("⏳ Резервное копирование уже выполняется.")
+            return
+
+        await update.message.reply_text("💾 Резервное копирование запущено...")
+        try:
+            stats = await self.run_backup()
+        except Exception as e:
+            logger.error(f"Ошибка резервного копирования: {e}")
+            await update.message.reply_text(f"❌ Ошибка резервного копирования: {e}")
+            return
+
+        await update.message.reply_text(
+            "✅ Резервная копия создана\n\n"
+            f"Файл: {stats['path']}\n"
+            f"Размер: {stats['size'] / 1024:.1f} КБ ({stats['pages']} страниц, шагов: {stats['steps']})\n"
+            f"Проверка целостности: {stats['integrity']}\n"
+            f"Рестартов из-за записи: {stats['restarts']}"
+            f"{' (доделано за один шаг)' if stats['single_step'] else ''}\n"
+            f"Длительность: {stats['duration']:.2f} с\n"
+            f"Задержка обработчиков: макс. {stats['max_lag'] * 1000:.1f} мс, "
+            f"сред. {stats['avg_lag'] * 1000:.1f} мс\n"
+            f"Удалено старых копий: {len(stats['removed'])}"
+        )
+
+    # Maintenance functions
+    async def run_maintenance(self, force_vacuum: bool = False) -> Dict[str, Any]:
+        """Удаление устаревших записей и, в простое, освобождение места"""
+        async with self.maintenance_lock:
+            stats = await asyncio.to_thread(
+                db.purge_expired, config.RETENTION_DEFAULT_DAYS,
+                config.RETENTION_BATCH_SIZE, config.RETENTION_BATCH_PAUSE
+            )
+            idle = timer.monotonic() - self.last_activity
+            stats['vacuum'] = None
+            if force_vacuum or idle >= config.MAINTENANCE_IDLE_SECONDS:
+                stats['vacuum'] = await asyncio.to_thread(db.vacuum_step, config.VACUUM_PAGES_PER_RUN)
+                stats['max_lock'] = max(stats['max_lock'], stats['vacuum']['max_lock'])
+            return stats
+
+    async def scheduled_maintenance(self, context: CallbackContext):
+        """Обслуживание базы по расписанию"""
+        try:
+            stats = await self.run_maintenance()
+            vacuum = stats['vacuum']
+            logger.info(
+                f"Обслуживание базы: удалено {sum(stats['deleted'].values())} записей, "
+                f"освобождено {vacuum['reclaimed_bytes'] if vacuum else 0} байт, "
+                f"макс. блокировка {stats['max_lock'] * 1000:.1f} мс"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания базы: {e}")
+
+    async def set_retention(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Установка срока хранения архива чата"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        if not context.args or not context.args[0].isdigit():
+            await update.message.reply_text("❌ Формат: /set_retention дни (0 - хранить всегда)")
+            return
+
+        days = int(context.args[0])
+        db.set_retention(update.effective_chat.id, days)
+        if days:
+            await update.message.reply_text(f"✅ Архив чата хранится {days} дн.")
+        else:
+            await update.message.reply_text("✅ Архив чата хранится без ограничения срока.")
+
+    async def maintenance(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ручной запуск обслуживания базы (/maintenance [convert [force]])"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ Эта команда только для администраторов!")
+            return
+
+        if context.args and context.args[0].lower() == 'convert':
+            await self.convert_database(update, context)
+            return
+
+        if self.maintenance_lock.locked():
+            await update.message.reply_text("⏳ Обслуживание уже выполняется.")
+            return
+
+        stats = await self.run_maintenance(force_vacuum=True)
+        vacuum = stats['vacuum']
+        deleted = "\n".join(f"  {table}: {count}" for table, count in stats['deleted'].items())
+        vacuum_note = "" if vacuum['incremental'] else "\n(incremental vacuum выключен, см. /maintenance convert)"
+        await update.message.reply_text(
+            "🧹 Обслуживание завершено\n\n"
+            f"Удалено записей:\n{deleted}\n"
+            f"Пачек: {stats['batches']}, длительность: {stats['duration']:.2f} с\n"
+            f"Освобождено: {vacuum['reclaimed_bytes'] / 1024:.1f} КБ, "
+            f"свободно в файле: {vacuum['free_bytes'] / 1024:.1f} КБ\n"
+            f"Макс. удержание блокировки: {stats['max_lock'] * 1000:.1f} мс"
+            f"{vacuum_note}"
+        )
+
+    async def convert_database(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Перевод базы в режим incremental vacuum.
+
+        Полный VACUUM блокирует запись на все время работы и временно требует
+        места на вторую копию базы, поэтому он не пересекается с обслуживанием
+        и резервным копированием, а большую или активную базу без force
+        не трогает.
+        """
+        force = len(context.args) > 1 and context.args[1].lower() == 'force'
+        if self.maintenance_lock.locked() or self.backup_lock.locked():
+            await update.message.reply_text("⏳ Идет обслуживание или резервное копирование, попробуйте позже.")
+            return
+
+        size_mb = os.path.getsize(db.db_name) / 2 ** 20
+        idle = timer.monotonic() - self.last_activity
+        if not force:
+            if size_mb > config.MAINTENANCE_CONVERT_MAX_MB:
+                await update.message.reply_text(
+                    f"⚠️ База занимает {size_mb:.1f} МБ: полный VACUUM надолго заблокирует запись "
+                    f"и потребует столько же свободного места.\n"
+                    f"Если это допустимо: /maintenance convert force"
+                )
+                return
+            if idle < config.MAINTENANCE_IDLE_SECONDS:
+                await update.message.reply_text(
+                    f"⚠️ Последнее сообщение было {idle:.0f} с назад: во время VACUUM архивация "
+                    f"будет ждать. Повторите в простое или: /maintenance convert force"
+                )
+                return
+
+        async with self.maintenance_lock, self.backup_lock:
+            await update.message.reply_text(
+                f"⏳ Перевод базы ({size_mb:.1f} МБ) в режим incremental vacuum (полный VACUUM)..."
+            )
+            try:
+                converted = await asyncio.to_thread(db.enable_incremental_vacuum)
+            except Exception as e:
+                logger.error(f"Ошибка перевода базы в incremental vacuum: {e}")
+                await update.message.reply_text(f"❌ Ошибка перевода базы: {e}")
+                return
+        await update.message.reply_text("✅ Готово." if converted else "✅ База уже в этом режиме.")
+
     # Utility functions
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ошибок"""
@@ -357,14 +854,26 @@ class ClassBot:
         self.application.add_handler(CommandHandler("get_hw", self.get_hw))
         self.application.add_handler(CommandHandler("set_duty", self.set_duty))
         self.application.add_handler(CommandHandler("duty", self.duty))
+        self.application.add_handler(CommandHandler("set_roster", self.set_roster))
+        self.application.add_handler(CommandHandler("add_holiday", self.add_holiday))
         self.application.add_handler(CommandHandler("post_schedule", self.post_schedule))
         self.application.add_handler(CommandHandler("post_t_schedule", self.post_t_schedule))
         self.application.add_handler(CommandHandler("t_schedule", self.t_schedule))
         self.application.add_handler(CommandHandler("schedule", self.schedule))
         self.application.add_handler(CommandHandler("get_chat_log", self.get_chat_log))
         self.application.add_handler(CommandHandler("get_user_log", self.get_user_log))
+        self.application.add_handler(CommandHandler("get_media_log", self.get_media_log))
+        self.application.add_handler(CommandHandler("browse_log", self.browse_log))
+        self.application.add_handler(CallbackQueryHandler(self.browse_log_page, pattern=r'^log:'))
+        self.application.add_handler(CommandHandler("backup", self.backup))
+        self.application.add_handler(CommandHandler("compress_archive", self.compress_archive))
+        self.application.add_handler(CommandHandler("db_profile", self.db_profile))
+        self.application.add_handler(CommandHandler("set_retention", self.set_retention))
+        self.application.add_handler(CommandHandler("maintenance", self.maintenance))
         self.application.add_handler(CommandHandler("post_ready_hw", self.post_ready_hw))
         self.application.add_handler(CommandHandler("get_ready_hw", self.get_ready_hw))
+        self.application.add_handler(CommandHandler("chat_stats", self.chat_stats))
+        self.application.add_handler(CommandHandler("rebuild_stats", self.rebuild_stats))
         self.application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, self.archive_message))
         self.application.add_error_handler(self.error_handler)
 
@@ -373,6 +882,21 @@ class ClassBot:
         self.application = Application.builder().token(config.BOT_TOKEN).build()
         self.setup_handlers()
         db.clear_old_duty()
+        db.compress_text = config.ARCHIVE_COMPRESSION
+        if config.DB_PROFILING:
+            db.enable_profiling(config.DB_SLOW_QUERY_MS)
+        if config.BACKUP_INTERVAL_HOURS:
+            if self.application.job_queue:
+                interval = config.BACKUP_INTERVAL_HOURS * 3600
+                self.application.job_queue.run_repeating(self.scheduled_backup, interval=interval, first=interval)
+            else:
+                logger.warning("JobQueue недоступна, резервное копирование по расписанию отключено")
+        if config.MAINTENANCE_INTERVAL_MINUTES:
+            if self.application.job_queue:
+                interval = config.MAINTENANCE_INTERVAL_MINUTES * 60
+                self.application.job_queue.run_repeating(self.scheduled_maintenance, interval=interval, first=interval)
+            else:
+                logger.warning("JobQueue недоступна, обслуживание базы по расписанию отключено")
         logger.info("Бот запущен...")
         self.application.run_polling(allowed_updates=Update.ALL_TYPES)
 
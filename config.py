@@ -2,3 +2,29 @@ BOT_TOKEN = ""
 ADMIN_IDS = []  # ID администраторов
 
 DB_NAME = "class_bot.db"
+
+LOG_PAGE_SIZE = 10  # Сообщений на странице /browse_log
+
+# Резервное копирование
+BACKUP_DIR = "backups"
+BACKUP_KEEP = 7  # Сколько последних снимков хранить
+BACKUP_INTERVAL_HOURS = 24  # 0 - не делать копии по расписанию
+BACKUP_PAGES_PER_STEP = 100
+BACKUP_STEP_PAUSE = 0.05  # Пауза между шагами копирования, сек
+BACKUP_MAX_RESTARTS = 3  # После стольких рестартов из-за записи копия делается за один шаг
+
+# Сжатие текста сообщений в архиве (словарь обучается командой /compress_archive)
+ARCHIVE_COMPRESSION = False
+
+# Профилирование SQL-запросов
+DB_PROFILING = False
+DB_SLOW_QUERY_MS = 50  # Порог медленного запроса, мс
+
+# Срок хранения архива и обслуживание базы
+RETENTION_DEFAULT_DAYS = 0  # Для чатов без /set_retention; 0 - хранить всегда
+RETENTION_BATCH_SIZE = 500  # Строк за одну транзакцию удаления
+RETENTION_BATCH_PAUSE = 0.1  # Пауза между пачками, сек
+MAINTENANCE_INTERVAL_MINUTES = 60  # 0 - не запускать по расписанию
+MAINTENANCE_IDLE_SECONDS = 300  # VACUUM/optimize только если столько секунд не было сообщений
+VACUUM_PAGES_PER_RUN = 1000
+MAINTENANCE_CONVERT_MAX_MB = 200  # /maintenance convert для базы больше этого - только с force
\ No newline at end of file
@@ -1,25 +1,68 @@
 import sqlite3
 import datetime
+import bisect
+import os
+import time
+import zlib
+import struct
+from collections import Counter
 from typing import Optional, List, Tuple, Dict, Any
 import logging
 
+from db_profiler import QueryProfiler
+import config
+
 logger = logging.getLogger(__name__)
 
 
+class _BackupRestarted(Exception):
+    """Пошаговое копирование слишком часто начиналось заново из-за записи в БД"""
+
+
 class Database:
     def __init__(self, db_name: str = "class_bot.db"):
         self.db_name = db_name
+        # Кэш дежурных: chat_id -> (день, результат)
+        self._duty_cache: Dict[int, Tuple[str, Optional[tuple]]] = {}
+        # Кэш графиков дежурств: chat_id -> (участники, дата начала, праздники)
+        self._roster_cache: Dict[int, Optional[tuple]] = {}
+        # Сжатие текста архива: включается через config.ARCHIVE_COMPRESSION
+        self.compress_text = False
+        # Словари сжатия: id -> данные; текущий словарь для новых сообщений
+        self._text_dicts: Dict[int, bytes] = {}
+        self._current_text_dict: Optional[Tuple[int, bytes]] = None
+        # Профилировщик запросов (None - выключен), см. enable_profiling
+        self.profiler: Optional[QueryProfiler] = None
         self.init_database()
 
     def get_connection(self):
         """Создает соединение с базой данных"""
-        return sqlite3.connect(self.db_name, check_same_thread=False)
+        if self.profiler:
+            conn = sqlite3.connect(self.db_name, check_same_thread=False, factory=self.profiler.connection_factory)
+        else:
+            conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        # unpack_text(text) прозрачно распаковывает сжатый текст сообщений
+        conn.create_function('unpack_text', 1, self._unpack_text, deterministic=True)
+        return conn
+
+    def enable_profiling(self, slow_ms: float = 50.0) -> QueryProfiler:
+        """Включает профилирование всех запросов через get_connection"""
+        if self.profiler is None:
+            self.profiler = QueryProfiler(slow_ms)
+        self.profiler.slow_ms = slow_ms
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
 
     def init_database(self):
         """Инициализирует таблицы базы данных"""
         conn = self.get_connection()
         cursor = conn.cursor()
 
+        # Для новой базы включаем пошаговое освобождение места (действует только до создания таблиц)
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
         # Таблица для домашних заданий
         cursor.execute('''
                        CREATE TABLE IF NOT EXISTS homework
@@ -187,6 +230,35 @@ class Database:
                        )
                        ''')
 
+        # Таблица для метаданных медиафайлов (одна запись на file_unique_id)
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS media
+                       (
+                           file_unique_id
+                           TEXT
+                           PRIMARY
+                           KEY,
+                           file_id
+                           TEXT,
+                           media_type
+                           TEXT,
+                           file_size
+                           INTEGER,
+                           width
+                           INTEGER,
+                           height
+                           INTEGER,
+                           duration
+                           INTEGER,
+                           mime_type
+                           TEXT,
+                           created_at
+                           TIMESTAMP
+                           DEFAULT
+                           CURRENT_TIMESTAMP
+                       )
+                       ''')
+
         # Таблица для пользователей
         cursor.execute('''
                        CREATE TABLE IF NOT EXISTS users
@@ -235,6 +307,147 @@ class Database:
                        )
                        ''')
 
+        # Таблица для словарей сжатия текста архива
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS text_dictionaries
+                       (
+                           id
+                           INTEGER
+                           PRIMARY
+                           KEY
+                           AUTOINCREMENT,
+                           data
+                           BLOB,
+                           created_at
+                           TIMESTAMP
+                           DEFAULT
+                           CURRENT_TIMESTAMP
+                       )
+                       ''')
+
+        # Таблица для сроков хранения архива по чатам
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS retention_policy
+                       (
+                           chat_id
+                           INTEGER
+                           PRIMARY
+                           KEY,
+                           days
+                           INTEGER,
+                           created_at
+                           TIMESTAMP
+                           DEFAULT
+                           CURRENT_TIMESTAMP
+                       )
+                       ''')
+
+        # Граница удаленного по сроку хранения архива (статистика до нее не пересчитывается)
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS retention_state
+                       (
+                           chat_id
+                           INTEGER
+                           PRIMARY
+                           KEY,
+                           purged_before
+                           TIMESTAMP
+                       )
+                       ''')
+
+        # Индекс для постраничного просмотра архива по (chat_id, date, id)
+        cursor.execute('''
+                       CREATE INDEX IF NOT EXISTS idx_messages_chat_date
+                           ON messages (chat_id, date, id)
+                       ''')
+
+        # Индекс для поиска ссылок на медиа (очистка media после удаления сообщений)
+        cursor.execute('''
+                       CREATE INDEX IF NOT EXISTS idx_messages_photo_id
+                           ON messages (photo_id) WHERE photo_id IS NOT NULL
+                       ''')
+
+        # Таблица для графика дежурств
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS duty_roster
+                       (
+                           chat_id
+                           INTEGER
+                           PRIMARY
+                           KEY,
+                           members
+                           TEXT,
+                           start_date
+                           DATE,
+                           created_at
+                           TIMESTAMP
+                           DEFAULT
+                           CURRENT_TIMESTAMP
+                       )
+                       ''')
+
+        # Таблица для праздников и каникул (дни без дежурства)
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS duty_holidays
+                       (
+                           chat_id
+                           INTEGER,
+                           day
+                           DATE,
+                           PRIMARY
+                           KEY
+                       (
+                           chat_id,
+                           day
+                       )
+                           )
+                       ''')
+
+        # Сводная статистика активности по дням (обновляется при архивации)
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS chat_daily_stats
+                       (
+                           chat_id
+                           INTEGER,
+                           day
+                           DATE,
+                           message_count
+                           INTEGER
+                           DEFAULT
+                           0,
+                           PRIMARY
+                           KEY
+                       (
+                           chat_id,
+                           day
+                       )
+                           )
+                       ''')
+
+        # Сводная статистика активности пользователей по дням
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS chat_user_daily_stats
+                       (
+                           chat_id
+                           INTEGER,
+                           user_id
+                           INTEGER,
+                           day
+                           DATE,
+                           message_count
+                           INTEGER
+                           DEFAULT
+                           0,
+                           PRIMARY
+                           KEY
+                       (
+                           chat_id,
+                           day,
+                           user_id
+                       )
+                           )
+                       ''')
+
         conn.commit()
         conn.close()
 
@@ -307,7 +520,13 @@ class Database:
         return result[0] if result else None
 
     # Duty methods
+    @staticmethod
+    def _today() -> datetime.date:
+        """Текущая дата (UTC, как DATE('now') в SQLite)"""
+        return datetime.datetime.now(datetime.timezone.utc).date()
+
     def save_duty(self, chat_id: int, user1_id: int, user1_name: str, user2_id: int, user2_name: str):
+        """Ручное назначение дежурных на сегодня (перекрывает график)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         # Удаляем старые записи для этого чата
@@ -318,16 +537,29 @@ class Database:
         )
         conn.commit()
         conn.close()
+        self._duty_cache.pop(chat_id, None)
 
     def get_duty(self, chat_id: int) -> Optional[tuple]:
+        """Дежурные на сегодня: ручное назначение или расчет по графику"""
+        today = self._today()
+        day = today.isoformat()
+        cached = self._duty_cache.get(chat_id)
+        if cached and cached[0] == day:
+            return cached[1]
+
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT user1_name, user2_name FROM duty WHERE chat_id = ? AND date = DATE('now')",
-            (chat_id,)
+            "SELECT user1_name, user2_name FROM duty WHERE chat_id = ? AND date = ?",
+            (chat_id, day)
         )
         result = cursor.fetchone()
         conn.close()
+
+        if result is None:
+            result = self.get_roster_duty(chat_id, today)
+
+        self._duty_cache[chat_id] = (day, result)
         return result
 
     def clear_old_duty(self):
@@ -338,6 +570,92 @@ class Database:
         conn.commit()
         conn.close()
 
+    # Duty roster methods
+    def save_duty_roster(self, chat_id: int, members: List[str], start_date: Optional[datetime.date] = None):
+        """Сохраняет график дежурств; ротация идет парами по порядку участников"""
+        start_date = start_date or self._today()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO duty_roster (chat_id, members, start_date) VALUES (?, ?, ?)",
+            (chat_id, ','.join(members), start_date.isoformat())
+        )
+        conn.commit()
+        conn.close()
+        self._roster_cache.pop(chat_id, None)
+        self._duty_cache.pop(chat_id, None)
+
+    def get_duty_roster(self, chat_id: int) -> Optional[tuple]:
+        """Возвращает (участники, дата начала, отсортированные праздники) с кэшированием"""
+        if chat_id in self._roster_cache:
+            return self._roster_cache[chat_id]
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT members, start_date FROM duty_roster WHERE chat_id = ?",
+            (chat_id,)
+        )
+        row = cursor.fetchone()
+        roster = None
+        if row and row[0]:
+            cursor.execute(
+                "SELECT day FROM duty_holidays WHERE chat_id = ? ORDER BY day",
+                (chat_id,)
+            )
+            holidays = [
+                day for day in (datetime.date.fromisoformat(r[0]) for r in cursor.fetchall())
+                if day.weekday() < 5
+            ]
+            roster = (row[0].split(','), datetime.date.fromisoformat(row[1]), holidays)
+        conn.close()
+
+        self._roster_cache[chat_id] = roster
+        return roster
+
+    def add_duty_holidays(self, chat_id: int, start: datetime.date, end: Optional[datetime.date] = None) -> int:
+        """Отмечает дни с start по end (включительно) как дни без дежурства"""
+        end = end or start
+        days = [
+            (chat_id, (start + datetime.timedelta(days=i)).isoformat())
+            for i in range((end - start).days + 1)
+        ]
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR IGNORE INTO duty_holidays (chat_id, day) VALUES (?, ?)",
+            days
+        )
+        conn.commit()
+        conn.close()
+        self._roster_cache.pop(chat_id, None)
+        self._duty_cache.pop(chat_id, None)
+        return len(days)
+
+    @staticmethod
+    def _school_days_between(start: datetime.date, end: datetime.date) -> int:
+        """Количество будних дней в полуинтервале [start, end)"""
+        weeks, rest = divmod((end - start).days, 7)
+        first = start.weekday()
+        return weeks * 5 + sum(1 for i in range(rest) if (first + i) % 7 < 5)
+
+    def get_roster_duty(self, chat_id: int, day: datetime.date) -> Optional[tuple]:
+        """Рассчитывает пару дежурных на день по графику без обращения к таблице duty"""
+        roster = self.get_duty_roster(chat_id)
+        if roster is None:
+            return None
+
+        members, start_date, holidays = roster
+        if day < start_date or day.weekday() >= 5:
+            return None
+        pos = bisect.bisect_left(holidays, day)
+        if pos < len(holidays) and holidays[pos] == day:
+            return None
+
+        skipped = pos - bisect.bisect_left(holidays, start_date)
+        index = (self._school_days_between(start_date, day) - skipped) * 2
+        return members[index % len(members)], members[(index + 1) % len(members)]
+
     # Schedule methods
     def save_schedule(self, chat_id: int, text: str):
         conn = self.get_connection()
@@ -418,25 +736,53 @@ class Database:
             message_data.get('chat_username')
         ))
 
-        # Сохраняем сообщение
+        # Сохраняем метаданные медиа; повторно пересланный файл не дублируется
+        media = message_data.get('media')
+        # photo_id в messages хранит ссылку на media.file_unique_id
+        photo_id = media['file_unique_id'] if media else message_data.get('photo_id')
+        if media:
+            cursor.execute('''
+                INSERT OR IGNORE INTO media (file_unique_id, file_id, media_type, file_size,
+                                             width, height, duration, mime_type)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                media['file_unique_id'],
+                media['file_id'],
+                media['media_type'],
+                media.get('file_size'),
+                media.get('width'),
+                media.get('height'),
+                media.get('duration'),
+                media.get('mime_type')
+            ))
+
+        # Сохраняем сообщение; имя пользователя берется из users через JOIN
+        text = message_data['text']
+        if self.compress_text:
+            text = self._pack_text(text, cursor)
         cursor.execute('''
-                       INSERT INTO messages (message_id, chat_id, chat_type, user_id, username,
-                                             first_name, last_name, phone_number, photo_id, text, date)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       INSERT INTO messages (message_id, chat_id, chat_type, user_id,
+                                             phone_number, photo_id, text, date)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                        ''', (
                            message_data['message_id'],
                            message_data['chat_id'],
                            message_data['chat_type'],
                            message_data['user_id'],
-                           message_data['username'],
-                           message_data['first_name'],
-                           message_data['last_name'],
                            message_data.get('phone_number'),
-                           message_data.get('photo_id'),
-                           message_data['text'],
+                           photo_id,
+                           text,
                            message_data['date']
                        ))
 
+        # Обновляем сводную статистику в той же транзакции
+        self._bump_activity_stats(
+            cursor,
+            message_data['chat_id'],
+            message_data['user_id'],
+            self._day_key(message_data['date'])
+        )
+
         conn.commit()
         conn.close()
 
@@ -444,9 +790,10 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-                       SELECT m.date, u.username, u.first_name, u.last_name, m.text
+                       SELECT m.date, u.username, u.first_name, u.last_name, unpack_text(m.text), md.media_type, md.file_unique_id
                        FROM messages m
                                 JOIN users u ON m.user_id = u.user_id
+                                LEFT JOIN media md ON m.photo_id = md.file_unique_id
                        WHERE m.chat_id = ?
                        ORDER BY m.date
                        ''', (chat_id,))
@@ -458,9 +805,10 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-                       SELECT m.date, c.title, m.text
+                       SELECT m.date, c.title, unpack_text(m.text), md.media_type, md.file_unique_id
                        FROM messages m
                                 JOIN chats c ON m.chat_id = c.chat_id
+                                LEFT JOIN media md ON m.photo_id = md.file_unique_id
                        WHERE m.user_id = ?
                        ORDER BY m.date
                        ''', (user_id,))
@@ -468,6 +816,545 @@ class Database:
         conn.close()
         return result
 
+    def get_chat_log_page(self, chat_id: int, page_cursor: Optional[Tuple[str, int]] = None,
+                          older: bool = True, limit: int = 10) -> Tuple[List[tuple], bool]:
+        """Страница лога чата по ключу (date, id) без OFFSET.
+
+        page_cursor - (date, id) крайнего сообщения предыдущей страницы (None -
+        последние сообщения), older - направление. Возвращает строки в хронологическом
+        порядке и признак того, что в этом направлении есть еще сообщения.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        columns = '''
+            SELECT m.id, m.date, u.username, u.first_name, u.last_name, unpack_text(m.text), md.media_type
+            FROM messages m
+                     LEFT JOIN users u ON m.user_id = u.user_id
+                     LEFT JOIN media md ON m.photo_id = md.file_unique_id
+            WHERE m.chat_id = ?
+        '''
+        if page_cursor is None:
+            cursor.execute(columns + " ORDER BY m.date DESC, m.id DESC LIMIT ?", (chat_id, limit + 1))
+        elif older:
+            cursor.execute(columns + '''
+                  AND (m.date, m.id) < (?, ?)
+                ORDER BY m.date DESC, m.id DESC LIMIT ?
+            ''', (chat_id, *page_cursor, limit + 1))
+        else:
+            cursor.execute(columns + '''
+                  AND (m.date, m.id) > (?, ?)
+                ORDER BY m.date, m.id LIMIT ?
+            ''', (chat_id, *page_cursor, limit + 1))
+        rows = cursor.fetchall()
+        conn.close()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if page_cursor is None or older:
+            rows.reverse()
+        return rows, has_more
+
+    def get_chat_media(self, chat_id: int) -> List[tuple]:
+        """Список медиа, отправленных в чат (без скачивания файлов)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+                       SELECT m.date, m.message_id, md.media_type, md.file_unique_id, md.file_id,
+                              md.file_size, md.width, md.height, md.duration
+                       FROM messages m
+                                JOIN media md ON m.photo_id = md.file_unique_id
+                       WHERE m.chat_id = ?
+                       ORDER BY m.date
+                       ''', (chat_id,))
+        result = cursor.fetchall()
+        conn.close()
+        return result
+
+    # Text compression methods
+    # Сжатый текст хранится как BLOB: 2 байта id словаря (0 - без словаря) + raw deflate
+    def _load_text_dict(self, cursor, dict_id: Optional[int] = None) -> Optional[Tuple[int, bytes]]:
+        if dict_id is None:
+            cursor.execute("SELECT id, data FROM text_dictionaries ORDER BY id DESC LIMIT 1")
+        else:
+            cursor.execute("SELECT id, data FROM text_dictionaries WHERE id = ?", (dict_id,))
+        row = cursor.fetchone()
+        if row:
+            self._text_dicts[row[0]] = row[1]
+        return row
+
+    def _pack_text(self, text: str, cursor) -> Any:
+        """Сжимает текст текущим словарем, если это дает выигрыш"""
+        raw = text.encode('utf-8')
+        if not raw:
+            return text
+        if self._current_text_dict is None:
+            self._current_text_dict = self._load_text_dict(cursor) or (0, b'')
+
+        dict_id, zdict = self._current_text_dict
+        if zdict:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=zdict)
+        else:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        packed = struct.pack('>H', dict_id) + compressor.compress(raw) + compressor.flush()
+        return packed if len(packed) < len(raw) else text
+
+    def _unpack_text(self, value):
+        """Распаковывает текст, сжатый _pack_text; обычный текст возвращает как есть"""
+        if not isinstance(value, bytes):
+            return value
+        dict_id = struct.unpack('>H', value[:2])[0]
+        if dict_id:
+            zdict = self._text_dicts.get(dict_id)
+            if zdict is None:
+                conn = sqlite3.connect(self.db_name, check_same_thread=False)
+                self._load_text_dict(conn.cursor(), dict_id)
+                conn.close()
+                zdict = self._text_dicts[dict_id]
+            decompressor = zlib.decompressobj(-15, zdict=zdict)
+        else:
+            decompressor = zlib.decompressobj(-15)
+        return (decompressor.decompress(value[2:]) + decompressor.flush()).decode('utf-8')
+
+    def train_text_dictionary(self, sample_size: int = 5000, dict_size: int = 16384) -> int:
+        """Обучает словарь сжатия на последних сообщениях архива.
+
+        В словарь попадают самые «выгодные» слова и пары слов (частота * длина);
+        самые частые ставятся в конец, где deflate ссылается на них дешевле.
+        Возвращает id нового словаря.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT unpack_text(text) FROM messages ORDER BY id DESC LIMIT ?",
+            (sample_size,)
+        )
+        counts = Counter()
+        for (text,) in cursor.fetchall():
+            words = (text or '').split()
+            counts.update(w for w in words if len(w) > 2)
+            counts.update(' '.join(pair) for pair in zip(words, words[1:]))
+
+        chunks, size = [], 0
+        ranked = sorted(
+            ((count * len(item.encode('utf-8')), item) for item, count in counts.items() if count > 1),
+            reverse=True
+        )
+        for _, item in ranked:
+            chunk = (item + ' ').encode('utf-8')
+            if size + len(chunk) > dict_size:
+                continue
+            chunks.append(chunk)
+            size += len(chunk)
+        zdict = b''.join(reversed(chunks))
+
+        cursor.execute("INSERT INTO text_dictionaries (data) VALUES (?)", (zdict,))
+        dict_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+        self._text_dicts[dict_id] = zdict
+        self._current_text_dict = (dict_id, zdict)
+        return dict_id
+
+    def compress_archive(self, batch_size: int = 500, sample_size: int = 2000) -> Dict[str, Any]:
+        """Пересжимает архив текущим словарем и убирает дублирующие поля пользователя.
+
+        Работает пачками по id, каждая пачка - отдельная короткая транзакция.
+        Возвращает объем до/после и стоимость чтения (распаковки) на сообщение.
+        """
+        stats = {'rows': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        last_id = 0
+        while True:
+            cursor.execute(
+                "SELECT id, text FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            updates = []
+            for row_id, stored in rows:
+                text = self._unpack_text(stored) or ''
+                packed = self._pack_text(text, cursor)
+                stats['rows'] += 1
+                stats['raw_bytes'] += len(text.encode('utf-8'))
+                stats['stored_bytes'] += len(packed) if isinstance(packed, bytes) else len(packed.encode('utf-8'))
+                updates.append((packed, row_id))
+            cursor.executemany(
+                "UPDATE messages SET text = ?, username = NULL, first_name = NULL, last_name = NULL WHERE id = ?",
+                updates
+            )
+            conn.commit()
+            last_id = rows[-1][0]
+
+        # Стоимость чтения: выборка с unpack_text против простого чтения хранимого значения
+        def timed_read(expression: str) -> Tuple[float, int]:
+            started = time.perf_counter()
+            cursor.execute(
+                f"SELECT {expression} FROM messages ORDER BY id DESC LIMIT ?",
+                (sample_size,)
+            )
+            rows = cursor.fetchall()
+            return time.perf_counter() - started, len(rows)
+
+        plain_time, sampled = timed_read("text")
+        unpack_time, _ = timed_read("unpack_text(text)")
+        conn.close()
+
+        stats['ratio'] = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 1.0
+        stats['plain_read_us'] = plain_time / sampled * 1e6 if sampled else 0.0
+        stats['unpack_read_us'] = unpack_time / sampled * 1e6 if sampled else 0.0
+        stats['decode_us'] = max(stats['unpack_read_us'] - stats['plain_read_us'], 0.0)
+        stats['dict_size'] = len(self._current_text_dict[1]) if self._current_text_dict else 0
+        logger.info(
+            f"Архив сжат: {stats['rows']} сообщений, {stats['raw_bytes']} -> {stats['stored_bytes']} байт "
+            f"(x{stats['ratio']:.2f}), распаковка {stats['decode_us']:.1f} мкс/сообщение"
+        )
+        return stats
+
+    # Backup methods
+    def backup(self, backup_dir: str, keep: int = 7, pages_per_step: int = 100,
+               step_pause: float = 0.05, max_restarts: int = 3) -> Dict[str, Any]:
+        """Онлайн-копия БД через SQLite backup API.
+
+        Копирует по pages_per_step страниц за шаг и спит step_pause секунд между
+        шагами, чтобы не держать блокировку. Любая запись в БД другим соединением
+        заставляет SQLite начать копирование заново; после max_restarts рестартов
+        копия доделывается за один шаг. Снимок проверяется integrity_check,
+        старые снимки сверх keep удаляются. Возвращает статистику копирования.
+        """
+        os.makedirs(backup_dir, exist_ok=True)
+        base = os.path.splitext(os.path.basename(self.db_name))[0]
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(backup_dir, f"{base}_{stamp}.db")
+        tmp_path = path + ".part"
+        stats = {'path': path, 'steps': 0, 'pages': 0, 'checkpoint': None,
+                 'restarts': 0, 'single_step': False}
+
+        started = time.perf_counter()
+        source = self.get_connection()
+        try:
+            # В режиме WAL сначала переносим журнал в основной файл без ожидания читателей
+            if source.execute("PRAGMA journal_mode").fetchone()[0].lower() == 'wal':
+                stats['checkpoint'] = source.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+
+            last_remaining = None
+
+            def progress(status, remaining, total):
+                nonlocal last_remaining
+                stats['steps'] += 1
+                stats['pages'] = total
+                # Рост remaining означает, что копирование началось сначала
+                if last_remaining is not None and remaining > last_remaining:
+                    stats['restarts'] += 1
+                    if stats['restarts'] >= max_restarts:
+                        raise _BackupRestarted()
+                last_remaining = remaining
+                time.sleep(step_pause)
+
+            target = sqlite3.connect(tmp_path)
+            try:
+                try:
+                    source.backup(target, pages=pages_per_step, progress=progress)
+                except _BackupRestarted:
+                    # Один шаг держит только разделяемую блокировку на время копирования
+                    stats['single_step'] = True
+                    source.backup(target, pages=-1)
+                stats['integrity'] = target.execute("PRAGMA integrity_check").fetchone()[0]
+            finally:
+                target.close()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            source.close()
+
+        if stats['integrity'] != 'ok':
+            os.remove(tmp_path)
+            raise sqlite3.DatabaseError(f"Снимок {path} поврежден: {stats['integrity']}")
+
+        os.replace(tmp_path, path)
+        stats['size'] = os.path.getsize(path)
+        stats['duration'] = time.perf_counter() - started
+
+        # Ротация: оставляем только keep последних снимков
+        snapshots = sorted(
+            name for name in os.listdir(backup_dir)
+            if name.startswith(base + "_") and name.endswith(".db")
+        )
+        stats['removed'] = snapshots[:-keep] if keep > 0 else []
+        for name in stats['removed']:
+            os.remove(os.path.join(backup_dir, name))
+
+        logger.info(
+            f"Резервная копия {path}: {stats['pages']} страниц за {stats['steps']} шагов, "
+            f"{stats['duration']:.2f} с"
+        )
+        return stats
+
+    # Retention and maintenance methods
+    # Таблица -> столбец даты; в таблицах с текстами для команд последняя запись чата не удаляется
+    RETENTION_TABLES = {
+        'messages': 'date',
+        'homework': 'created_at',
+        'ready_homework': 'created_at',
+        'schedule': 'created_at',
+        't_schedule': 'created_at',
+    }
+
+    def set_retention(self, chat_id: int, days: int):
+        """Срок хранения архива чата в днях (0 - хранить всегда)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO retention_policy (chat_id, days) VALUES (?, ?)",
+            (chat_id, days)
+        )
+        conn.commit()
+        conn.close()
+
+    def get_retention_policies(self, default_days: int = 0) -> List[tuple]:
+        """Пары (chat_id, days) для чатов, у которых срок хранения ограничен"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+                       SELECT c.chat_id, COALESCE(r.days, ?)
+                       FROM (SELECT chat_id FROM chats UNION SELECT chat_id FROM retention_policy) c
+                                LEFT JOIN retention_policy r ON c.chat_id = r.chat_id
+                       ''', (default_days,))
+        result = [(chat_id, days) for chat_id, days in cursor.fetchall() if days and days > 0]
+        conn.close()
+        return result
+
+    def purge_expired(self, default_days: int = 0, batch_size: int = 500,
+                      batch_pause: float = 0.1) -> Dict[str, Any]:
+        """Удаляет записи старше срока хранения небольшими пачками.
+
+        Каждая пачка - отдельная транзакция, между пачками пауза batch_pause,
+        чтобы архивация сообщений не ждала блокировку записи. Вместе с пачкой
+        сообщений удаляются медиа, на которые больше никто не ссылается.
+        """
+        stats = {'deleted': {table: 0 for table in self.RETENTION_TABLES}, 'batches': 0, 'max_lock': 0.0}
+        stats['deleted']['media'] = 0
+        started = time.perf_counter()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        for chat_id, days in self.get_retention_policies(default_days):
+            cutoff = (datetime.datetime.now(datetime.timezone.utc)
+                      - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            for table, column in self.RETENTION_TABLES.items():
+                sql = f'''
+                    DELETE FROM {table} WHERE id IN (
+                        SELECT id FROM {table}
+                        WHERE chat_id = ? AND {column} < ?
+                          AND id < (SELECT MAX(id) FROM {table} WHERE chat_id = ?)
+                        LIMIT ?
+                    )
+                '''
+                params = (chat_id, cutoff, chat_id, batch_size)
+
+                while True:
+                    lock_started = time.perf_counter()
+                    if table == 'messages':
+                        deleted, media_deleted = self._purge_messages_batch(cursor, chat_id, cutoff, batch_size)
+                        stats['deleted']['media'] += media_deleted
+                        if deleted:
+                            cursor.execute('''
+                                INSERT INTO retention_state (chat_id, purged_before) VALUES (?, ?)
+                                ON CONFLICT(chat_id) DO UPDATE
+                                    SET purged_before = MAX(purged_before, excluded.purged_before)
+                            ''', (chat_id, cutoff))
+                    else:
+                        cursor.execute(sql, params)
+                        deleted = cursor.rowcount
+                    conn.commit()
+                    stats['max_lock'] = max(stats['max_lock'], time.perf_counter() - lock_started)
+                    stats['deleted'][table] += deleted
+                    stats['batches'] += 1
+                    if deleted < batch_size:
+                        break
+                    time.sleep(batch_pause)
+
+        conn.close()
+        stats['duration'] = time.perf_counter() - started
+        return stats
+
+    @staticmethod
+    def _purge_messages_batch(cursor, chat_id: int, cutoff: str, batch_size: int) -> Tuple[int, int]:
+        """Удаляет пачку старых сообщений чата и осиротевшие медиа; возвращает (сообщений, медиа)"""
+        cursor.execute(
+            "SELECT id, photo_id FROM messages WHERE chat_id = ? AND date < ? ORDER BY date LIMIT ?",
+            (chat_id, cutoff, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return 0, 0
+
+        ids = [row[0] for row in rows]
+        cursor.execute(
+            f"DELETE FROM messages WHERE id IN ({','.join('?' * len(ids))})",
+            ids
+        )
+        deleted = cursor.rowcount
+
+        photo_ids = list({row[1] for row in rows if row[1] is not None})
+        if not photo_ids:
+            return deleted, 0
+        cursor.execute(f'''
+            DELETE FROM media
+            WHERE file_unique_id IN ({','.join('?' * len(photo_ids))})
+              AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.photo_id = media.file_unique_id)
+        ''', photo_ids)
+        return deleted, cursor.rowcount
+
+    def enable_incremental_vacuum(self) -> bool:
+        """Переводит существующую базу в auto_vacuum=INCREMENTAL (разовый полный VACUUM)"""
+        conn = self.get_connection()
+        try:
+            mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if mode != 2:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+        finally:
+            conn.close()
+        return mode != 2
+
+    def vacuum_step(self, max_pages: int = 1000) -> Dict[str, Any]:
+        """Освобождает до max_pages свободных страниц и обновляет статистику планировщика"""
+        conn = self.get_connection()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+        lock_started = time.perf_counter()
+        if auto_vacuum == 2:
+            # execute выполняет только первый шаг pragma (одна страница), executescript - до конца
+            conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+        lock_time = time.perf_counter() - lock_started
+
+        pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.close()
+        return {
+            'incremental': auto_vacuum == 2,
+            'reclaimed_bytes': (pages_before - pages_after) * page_size,
+            'free_bytes': freelist_after * page_size,
+            'freelist_before': freelist_before,
+            'max_lock': lock_time,
+        }
+
+    # Activity stats methods
+    @staticmethod
+    def _day_key(value) -> str:
+        """Возвращает день сообщения в формате YYYY-MM-DD"""
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()[:10]
+        return str(value)[:10]
+
+    @staticmethod
+    def _bump_activity_stats(cursor, chat_id: int, user_id: int, day: str, count: int = 1):
+        """Увеличивает счетчики сообщений за день для чата и пользователя"""
+        cursor.execute('''
+            INSERT INTO chat_daily_stats (chat_id, day, message_count)
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id, day) DO UPDATE SET message_count = message_count + excluded.message_count
+        ''', (chat_id, day, count))
+        cursor.execute('''
+            INSERT INTO chat_user_daily_stats (chat_id, user_id, day, message_count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id, day, user_id) DO UPDATE SET message_count = message_count + excluded.message_count
+        ''', (chat_id, user_id, day, count))
+
+    def get_chat_daily_stats(self, chat_id: int, days: int = 7) -> List[tuple]:
+        """Количество сообщений по дням за последние days дней"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+                       SELECT day, message_count
+                       FROM chat_daily_stats
+                       WHERE chat_id = ?
+                         AND day >= DATE('now', ?)
+                       ORDER BY day DESC
+                       ''', (chat_id, f'-{days - 1} days'))
+        result = cursor.fetchall()
+        conn.close()
+        return result
+
+    def get_chat_top_users(self, chat_id: int, days: int = 7, limit: int = 5) -> List[tuple]:
+        """Самые активные пользователи чата за последние days дней"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+                       SELECT s.user_id, u.username, u.first_name, u.last_name, SUM(s.message_count) AS total
+                       FROM chat_user_daily_stats s
+                                LEFT JOIN users u ON s.user_id = u.user_id
+                       WHERE s.chat_id = ?
+                         AND s.day >= DATE('now', ?)
+                       GROUP BY s.user_id
+                       ORDER BY total DESC
+                       LIMIT ?
+                       ''', (chat_id, f'-{days - 1} days', limit))
+        result = cursor.fetchall()
+        conn.close()
+        return result
+
+    def rebuild_activity_stats(self, chat_id: Optional[int] = None) -> int:
+        """Пересчитывает сводную статистику по архиву сообщений.
+
+        Дни до границы удаления по сроку хранения (включая день самой границы,
+        удаленный частично) не пересчитываются: их сообщений в архиве уже нет,
+        и счетчики остаются такими, какими были набраны при архивации.
+        Возвращает количество учтенных сообщений.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if chat_id is None:
+            where, params = "", ()
+        else:
+            where, params = "AND chat_id = ?", (chat_id,)
+
+        def horizon(table: str) -> str:
+            return f'''COALESCE((SELECT SUBSTR(r.purged_before, 1, 10) FROM retention_state r
+                                 WHERE r.chat_id = {table}.chat_id), '')'''
+
+        cursor.execute(
+            f"DELETE FROM chat_daily_stats WHERE day > {horizon('chat_daily_stats')} {where}",
+            params
+        )
+        cursor.execute(
+            f"DELETE FROM chat_user_daily_stats WHERE day > {horizon('chat_user_daily_stats')} {where}",
+            params
+        )
+        cursor.execute(f'''
+            INSERT INTO chat_daily_stats (chat_id, day, message_count)
+            SELECT chat_id, SUBSTR(date, 1, 10), COUNT(*)
+            FROM messages
+            WHERE SUBSTR(date, 1, 10) > {horizon('messages')} {where}
+            GROUP BY chat_id, SUBSTR(date, 1, 10)
+        ''', params)
+        cursor.execute(f'''
+            INSERT INTO chat_user_daily_stats (chat_id, user_id, day, message_count)
+            SELECT chat_id, user_id, SUBSTR(date, 1, 10), COUNT(*)
+            FROM messages
+            WHERE SUBSTR(date, 1, 10) > {horizon('messages')} {where}
+            GROUP BY chat_id, user_id, SUBSTR(date, 1, 10)
+        ''', params)
+        cursor.execute(
+            f"SELECT COALESCE(SUM(message_count), 0) FROM chat_daily_stats WHERE 1 {where}",
+            params
+        )
+        total = cursor.fetchone()[0]
+        conn.commit()
+        conn.close()
+        return total
+
 
 # Глобальный экземпляр базы данных
-db = Database()
\ No newline at end of file
+db = Database(config.DB_NAME)
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""Профилировщик SQL-запросов для Database.
+
+Подключается через фабрику соединений sqlite3: время каждого запроса
+(execute/executemany вместе с выборкой результатов) агрегируется по
+нормализованному тексту запроса. Для запросов дольше порога в лог пишутся параметры и
+план выполнения (EXPLAIN QUERY PLAN).
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """Приводит запрос к общему виду: литералы -> ?, списки IN -> (?), пробелы схлопнуты"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (?)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms: float = 50.0, slow_log_size: int = 100):
+        self.slow_ms = slow_ms
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self.plans: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def connection_factory(self, *args, **kwargs):
+        """Фабрика для sqlite3.connect(factory=...)"""
+        conn = ProfilingConnection(*args, **kwargs)
+        conn.profiler = self
+        conn.open_cursors = set()
+        return conn
+
+    def record(self, key: str, elapsed: float, calls: int = 1):
+        with self._lock:
+            item = self.stats.get(key)
+            if item is None:
+                item = self.stats[key] = {'calls': 0, 'total': 0.0, 'max': 0.0}
+            item['calls'] += calls
+            item['total'] += elapsed
+            item['max'] = max(item['max'], elapsed)
+
+    def record_slow(self, conn: sqlite3.Connection, key: str, sql: str, params, elapsed: float):
+        if key not in self.plans:
+            try:
+                plan_cursor = sqlite3.Connection.cursor(conn)
+                sqlite3.Cursor.execute(plan_cursor, "EXPLAIN QUERY PLAN " + sql, params)
+                self.plans[key] = [row[-1] for row in plan_cursor.fetchall()]
+            except sqlite3.Error as e:
+                self.plans[key] = [f"план недоступен: {e}"]
+
+        entry = {
+            'sql': key,
+            'params': repr(params)[:500],
+            'ms': elapsed * 1000,
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+        logger.warning(
+            f"Медленный запрос {entry['ms']:.1f} мс: {key} параметры={entry['params']} "
+            f"план={self.plans[key]}"
+        )
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+            self.slow_queries.clear()
+            self.plans.clear()
+
+    def report(self, top: int = 20) -> str:
+        """Текстовый отчет: самые затратные запросы и последние медленные"""
+        with self._lock:
+            items = sorted(self.stats.items(), key=lambda kv: kv[1]['total'], reverse=True)[:top]
+            slow = list(self.slow_queries)
+
+        lines = [f"Профиль запросов (топ {top} по суммарному времени)", "=" * 50]
+        for key, item in items:
+            lines.append(
+                f"{item['total'] * 1000:10.1f} мс  {item['calls']:7d} вызовов  "
+                f"сред. {item['total'] / item['calls'] * 1000:.2f} мс  макс. {item['max'] * 1000:.2f} мс"
+            )
+            lines.append(f"    {key}")
+            for step in self.plans.get(key, []):
+                lines.append(f"        план: {step}")
+
+        lines += ["", f"Медленные запросы (> {self.slow_ms} мс): {len(slow)}", "=" * 50]
+        for entry in slow:
+            lines.append(f"[{entry['at']}] {entry['ms']:.1f} мс {entry['sql']} {entry['params']}")
+        return "\n".join(lines)
+
+    def dump(self, path: str):
+        """Сохраняет статистику, планы и медленные запросы в JSON"""
+        with self._lock:
+            data = {
+                'slow_ms': self.slow_ms,
+                'stats': self.stats,
+                'plans': self.plans,
+                'slow_queries': list(self.slow_queries),
+            }
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    # Текущий запрос: [ключ, sql, параметры для плана, накопленное время, вызовов].
+    # Учитывается, когда результаты выбраны до конца, курсор выполняет новый
+    # запрос или закрывается (в том числе при закрытии соединения).
+    _pending: Optional[list] = None
+
+    def _timed(self, method, sql: str, params, calls: int, many: bool = False):
+        self.finish_statement()
+        started = time.perf_counter()
+        try:
+            return method(self, sql, params)
+        finally:
+            plan_params = (params[0] if params else ()) if many else params
+            self._pending = [normalize_sql(sql), sql, plan_params, time.perf_counter() - started, calls]
+            self.connection.open_cursors.add(self)
+            # Запросы без результата (INSERT/UPDATE/DDL) завершены сразу
+            if self.description is None:
+                self.finish_statement()
+
+    def finish_statement(self):
+        pending, self._pending = self._pending, None
+        self.connection.open_cursors.discard(self)
+        if pending is None:
+            return
+        key, sql, params, elapsed, calls = pending
+        profiler = self.connection.profiler
+        profiler.record(key, elapsed, calls)
+        if elapsed * 1000 >= profiler.slow_ms:
+            profiler.record_slow(self.connection, key, sql, params, elapsed)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sqlite3.Cursor.execute, sql, parameters, 1)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        return self._timed(sqlite3.Cursor.executemany, sql, seq_of_parameters, len(seq_of_parameters) or 1, True)
+
+    def _fetch(self, method, exhausted, *args):
+        started = time.perf_counter()
+        result = None
+        try:
+            result = method(self, *args)
+            return result
+        finally:
+            if self._pending is not None:
+                self._pending[3] += time.perf_counter() - started
+                if exhausted(result):
+                    self.finish_statement()
+
+    def fetchone(self):
+        return self._fetch(sqlite3.Cursor.fetchone, lambda row: row is None)
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        return self._fetch(sqlite3.Cursor.fetchmany, lambda rows: rows is None or len(rows) < size, size)
+
+    def fetchall(self):
+        return self._fetch(sqlite3.Cursor.fetchall, lambda rows: True)
+
+    def close(self):
+        if self._pending is not None:
+            self.finish_statement()
+        super().close()
+
+
+class ProfilingConnection(sqlite3.Connection):
+    profiler: QueryProfiler
+    open_cursors: set
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def close(self):
+        # Учитываем запросы, результаты которых прочитаны не до конца (fetchone)
+        for cursor in list(self.open_cursors):
+            cursor.finish_statement()
+        super().close()
+
+    # Connection.execute создает курсор на уровне C, минуя cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
\ No newline at end of file
@@ -0,0 +1,300 @@
+"""Длительный нагрузочный (soak) тест бота.
+
+Гоняет ClassBot.archive_message и команды чтения через поддельный бот
+с заданной частотой, периодически снимает метрики (tracemalloc, RSS,
+открытые дескрипторы и соединения с БД, размер БД/WAL, фрагментация)
+и завершается с ошибкой, если рост превышает заданные наклоны.
+
+Пример:
+    python soak_test.py --duration 7200 --rate 20 --db /tmp/soak.db
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Optional, List, Dict
+
+import config
+
+logger = logging.getLogger("soak_test")
+
+WORDS = ("дз", "математика", "завтра", "контрольная", "физика", "кто", "дежурит", "ок", "спасибо", "расписание")
+
+
+# Поддельные объекты Telegram
+class FakeBot:
+    def __init__(self):
+        self.documents_sent = 0
+        self.bytes_sent = 0
+
+    async def send_document(self, chat_id, document, filename=None):
+        self.documents_sent += 1
+        self.bytes_sent += len(document)
+
+
+class FakeChat(SimpleNamespace):
+    async def get_member(self, user_id):
+        return SimpleNamespace(status='administrator')
+
+
+class FakeMessage(SimpleNamespace):
+    async def reply_text(self, text, **kwargs):
+        return None
+
+
+def make_update(chat_id: int, user_id: int, message_id: int, text: str) -> SimpleNamespace:
+    chat = FakeChat(id=chat_id, type='supergroup', title=f"Чат {chat_id}", username=None)
+    user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="Тест", last_name=None)
+    message = FakeMessage(
+        message_id=message_id, text=text, caption=None,
+        date=datetime.datetime.now(datetime.timezone.utc),
+        photo=[], animation=None, video=None, video_note=None,
+        voice=None, audio=None, document=None, sticker=None
+    )
+    return SimpleNamespace(
+        effective_chat=chat, effective_user=user,
+        effective_message=message, message=message
+    )
+
+
+# Метрики процесса и БД
+def read_rss_bytes() -> Optional[int]:
+    """Текущий RSS процесса (Linux /proc, иначе пик через resource)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+    except ImportError:
+        return None
+
+
+def read_fd_stats(db_path: str) -> tuple:
+    """(всего открытых дескрипторов, из них на файлы БД)"""
+    fd_dir = '/proc/self/fd'
+    if not os.path.isdir(fd_dir):
+        return None, None
+    real_db = os.path.realpath(db_path)
+    total = db_fds = 0
+    for fd in os.listdir(fd_dir):
+        total += 1
+        try:
+            if os.readlink(os.path.join(fd_dir, fd)).startswith(real_db):
+                db_fds += 1
+        except OSError:
+            pass
+    return total, db_fds
+
+
+def read_db_stats(db_path: str) -> Dict[str, float]:
+    def size(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    conn = sqlite3.connect(db_path)
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.close()
+    return {
+        'db_bytes': size(db_path),
+        'wal_bytes': size(db_path + '-wal'),
+        'fragmentation': freelist / page_count if page_count else 0.0,
+    }
+
+
+def slope_per_hour(samples: List[tuple]) -> float:
+    """Наклон линейной регрессии (единиц в час) по точкам (секунды, значение)"""
+    points = [(t, v) for t, v in samples if v is not None]
+    if len(points) < 2:
+        return 0.0
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_v = sum(v for _, v in points) / n
+    var_t = sum((t - mean_t) ** 2 for t, _ in points)
+    if not var_t:
+        return 0.0
+    cov = sum((t - mean_t) * (v - mean_v) for t, v in points)
+    return cov / var_t * 3600
+
+
+class SoakTest:
+    def __init__(self, args):
+        self.args = args
+        self.samples: Dict[str, List[tuple]] = {}
+        self.messages_sent = 0
+        self.reads_done = 0
+        self.handler_time = 0.0
+        self.fake_bot = FakeBot()
+
+        # Глобальная БД создается при импорте database, поэтому имя файла
+        # задаем до импорта, чтобы не трогать рабочий архив
+        config.DB_NAME = args.db
+        import bot as bot_module
+        from database import db
+        self.db = db
+        self.bot = bot_module.ClassBot()
+        if args.profile:
+            db.enable_profiling(args.slow_ms)
+
+    def record(self, name: str, elapsed: float, value):
+        self.samples.setdefault(name, []).append((elapsed, value))
+
+    def take_snapshot(self, elapsed: float, previous):
+        current, _ = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        fds, db_fds = read_fd_stats(self.args.db)
+        db_stats = read_db_stats(self.args.db)
+
+        self.record('heap_mb', elapsed, current / 2 ** 20)
+        rss = read_rss_bytes()
+        self.record('rss_mb', elapsed, rss / 2 ** 20 if rss is not None else None)
+        self.record('fds', elapsed, fds)
+        self.record('db_connections', elapsed, db_fds)
+        self.record('db_mb', elapsed, db_stats['db_bytes'] / 2 ** 20)
+        self.record('wal_mb', elapsed, db_stats['wal_bytes'] / 2 ** 20)
+        self.record('fragmentation', elapsed, db_stats['fragmentation'])
+
+        logger.info(
+            f"[{elapsed:.0f}s] сообщений={self.messages_sent} чтений={self.reads_done} "
+            f"heap={current / 2 ** 20:.1f}MB rss={(rss or 0) / 2 ** 20:.1f}MB fds={fds} db_fds={db_fds} "
+            f"db={db_stats['db_bytes'] / 2 ** 20:.2f}MB wal={db_stats['wal_bytes'] / 2 ** 20:.2f}MB "
+            f"freelist={db_stats['fragmentation']:.1%}"
+        )
+        if previous is not None:
+            for stat in snapshot.compare_to(previous, 'lineno')[:self.args.top]:
+                logger.info(f"    {stat}")
+        return snapshot
+
+    async def read_commands(self, chat_id: int, user_id: int):
+        update = make_update(chat_id, user_id, 0, "/cmd")
+        context = SimpleNamespace(args=[], bot=self.fake_bot)
+        await self.bot.get_hw(update, context)
+        await self.bot.duty(update, context)
+        await self.bot.schedule(update, context)
+        await self.bot.chat_stats(update, context)
+        if self.args.log_every and self.reads_done % self.args.log_every == 0:
+            await self.bot.get_chat_log(update, context)
+        self.reads_done += 1
+
+    async def run(self) -> bool:
+        args = self.args
+        rng = random.Random(args.seed)
+        interval = 1.0 / args.rate
+        tracemalloc.start(args.frames)
+        start = time.monotonic()
+        next_snapshot = 0.0
+        snapshot = None
+
+        while True:
+            elapsed = time.monotonic() - start
+            if elapsed >= next_snapshot:
+                snapshot = self.take_snapshot(elapsed, snapshot)
+                next_snapshot += args.snapshot_interval
+            if elapsed >= args.duration:
+                break
+
+            chat_id = -1000 - rng.randrange(args.chats)
+            user_id = 1000 + rng.randrange(args.users)
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 20)))
+            self.messages_sent += 1
+
+            t0 = time.perf_counter()
+            update = make_update(chat_id, user_id, self.messages_sent, text)
+            await self.bot.archive_message(update, SimpleNamespace(args=[], bot=self.fake_bot))
+            if args.read_every and self.messages_sent % args.read_every == 0:
+                await self.read_commands(chat_id, user_id)
+            self.handler_time += time.perf_counter() - t0
+
+            # Выдерживаем заданную частоту, отдавая управление циклу событий
+            delay = start + self.messages_sent * interval - time.monotonic()
+            await asyncio.sleep(max(delay, 0))
+
+        tracemalloc.stop()
+        if self.args.profile:
+            profiler = self.db.profiler
+            logger.info("\n" + profiler.report())
+            profiler.dump(self.args.profile)
+        return self.report()
+
+    def report(self) -> bool:
+        args = self.args
+        warmup = args.duration * args.warmup
+        limits = {
+            'heap_mb': args.max_heap_slope,
+            'rss_mb': args.max_rss_slope,
+            'fds': args.max_fd_slope,
+            'db_connections': args.max_fd_slope,
+            'db_mb': args.max_db_slope,
+            'wal_mb': args.max_wal_slope,
+            'fragmentation': args.max_fragmentation_slope,
+        }
+
+        ok = True
+        hours = max(args.duration / 3600, 1e-9)
+        logger.info("=" * 60)
+        logger.info(
+            f"Отправлено сообщений: {self.messages_sent}, чтений: {self.reads_done}, "
+            f"среднее время обработки: {self.handler_time / max(self.messages_sent, 1) * 1000:.2f} мс"
+        )
+        for name, limit in limits.items():
+            samples = [(t, v) for t, v in self.samples.get(name, []) if t >= warmup]
+            slope = slope_per_hour(samples)
+            failed = limit is not None and slope > limit
+            ok = ok and not failed
+            logger.info(
+                f"{'FAIL' if failed else 'ok  '} {name}: наклон {slope:+.4f}/ч "
+                f"(за прогон {slope * hours:+.4f}, лимит {limit}/ч)"
+            )
+        return ok
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Soak-тест архивации и команд чтения")
+    parser.add_argument('--duration', type=float, default=4 * 3600, help="длительность, сек")
+    parser.add_argument('--rate', type=float, default=10, help="сообщений в секунду")
+    parser.add_argument('--chats', type=int, default=5)
+    parser.add_argument('--users', type=int, default=30)
+    parser.add_argument('--read-every', type=int, default=20, help="команды чтения каждые N сообщений (0 - выкл.)")
+    parser.add_argument('--log-every', type=int, default=50, help="/get_chat_log каждые N чтений (0 - выкл.)")
+    parser.add_argument('--snapshot-interval', type=float, default=60, help="интервал снимков, сек")
+    parser.add_argument('--warmup', type=float, default=0.1, help="доля прогона, не учитываемая в наклонах")
+    parser.add_argument('--frames', type=int, default=10, help="глубина стека tracemalloc")
+    parser.add_argument('--top', type=int, default=5, help="строк diff tracemalloc в каждом снимке")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', default='soak_test.db', help="файл БД для теста")
+    parser.add_argument('--profile', default=None, help="профилировать запросы и сохранить отчет в JSON-файл")
+    parser.add_argument('--slow-ms', type=float, default=50.0, help="порог медленного запроса, мс")
+    parser.add_argument('--max-heap-slope', type=float, default=1.0, help="МБ/ч")
+    parser.add_argument('--max-rss-slope', type=float, default=5.0, help="МБ/ч")
+    parser.add_argument('--max-fd-slope', type=float, default=0.5, help="дескрипторов/ч")
+    parser.add_argument('--max-db-slope', type=float, default=None, help="МБ/ч (по умолчанию не проверяется)")
+    parser.add_argument('--max-wal-slope', type=float, default=10.0, help="МБ/ч")
+    parser.add_argument('--max-fragmentation-slope', type=float, default=0.05, help="доля свободных страниц/ч")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    # Логи бота на каждое сообщение только мешают отчету
+    logging.getLogger('bot').setLevel(logging.WARNING)
+    args = parse_args(argv)
+    ok = asyncio.run(SoakTest(args).run())
+    logger.info("Soak-тест пройден" if ok else "Soak-тест НЕ пройден")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file